@@ -3,6 +3,9 @@ Streamlit Frontend
 The user interface for Virtual Staging AI.
 """
 
+import hashlib
+import io
+import os
 import sys
 from pathlib import Path
 
@@ -11,16 +14,49 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import time
-import json
-from typing import Optional, Tuple
-
-from app.config import DATA_INPUT_DIR, DATA_OUTPUT_DIR, SAMPLES_DIR
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+from PIL import Image
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+try:
+    import fcntl
+except ImportError:  # Windows: counter updates are not cross-process locked
+    fcntl = None
+
+from app.config import (
+    DATA_INPUT_DIR,
+    DATA_OUTPUT_DIR,
+    ENHANCE_JSON_SYSTEM,
+    SAMPLES_DIR,
+    SD_PROMPT_SYSTEM,
+    SYSTEM_PROMPT,
+)
+from app.data_models import EnhancePromptResponse, GenerateImageResponse
 
 # -----------------------------------------------------------------------------
 # Configuration & Constants
 # -----------------------------------------------------------------------------
 FASTAPI_URL = "http://127.0.0.1:8000"
+COUNTER_PATH = DATA_INPUT_DIR / ".next_id"
+
+# (connect, read) timeouts in seconds for backend calls
+HEALTH_TIMEOUT = (3, 5)
+ENHANCE_TIMEOUT = (3, 180)
+GENERATE_TIMEOUT = (3, 600)
+
+# Part of the enhance cache key so edited system prompts invalidate old entries
+PROMPT_VERSION = hashlib.blake2b(
+    (SYSTEM_PROMPT + SD_PROMPT_SYSTEM + ENHANCE_JSON_SYSTEM).encode("utf-8"),
+    digest_size=8,
+).hexdigest()
 
 st.set_page_config(
     page_title="Virtual Staging AI",
@@ -29,6 +65,26 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+for _key, _default in {
+    "selected_sample": None,
+    "result": None,
+    "job": None,
+    "job_started": 0.0,
+    "_session": None,
+}.items():
+    st.session_state.setdefault(_key, _default)
+
+# Keep-alive HTTP session, created once per browser session so reruns reuse
+# the pooled connection to the backend instead of opening a new socket.
+if st.session_state._session is None:
+    _session = requests.Session()
+    _session.mount(
+        "http://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0)
+    )
+    _session.headers.update({"Connection": "keep-alive"})
+    st.session_state._session = _session
+_SESSION: requests.Session = st.session_state._session
+
 CSS_STYLES = """
 <style>
     .stApp { background-color: #f8f9fc; }
@@ -53,66 +109,129 @@ class APIClient:
     @staticmethod
     def is_online() -> bool:
         try:
-            return requests.get(f"{FASTAPI_URL}/health", timeout=60).status_code == 200
+            resp = _SESSION.get(f"{FASTAPI_URL}/health", timeout=HEALTH_TIMEOUT)
+            return resp.status_code == 200
         except:
             return False
 
     @staticmethod
-    def enhance_prompt(description: str) -> dict:
-        resp = requests.post(
-            f"{FASTAPI_URL}/enhance-prompt",
-            json={"room_description": description},
-            timeout=180,
-        )
-        return resp.json()
+    def enhance_prompt(description: str) -> EnhancePromptResponse:
+        return _enhance_cached(description, PROMPT_VERSION)
 
     @staticmethod
     def generate_image(
-        prompt: str, description: str, image_path: str, resolution: int
-    ) -> dict:
+        prompt: str,
+        description: str,
+        image_path: str,
+        resolution: int,
+        task_type: str = "style",
+    ) -> GenerateImageResponse:
         payload = {
             "enhanced_prompt": prompt,
             "room_description": description,
             "image_path": image_path,
             "target_resolution": resolution,
+            "task_type": task_type,
         }
-        resp = requests.post(f"{FASTAPI_URL}/generate-image", json=payload, timeout=600)
-        return resp.json()
+        resp = _SESSION.post(
+            f"{FASTAPI_URL}/generate-image", json=payload, timeout=GENERATE_TIMEOUT
+        )
+        return GenerateImageResponse.model_validate_json(resp.content)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _enhance_cached(description: str, prompt_version: str) -> EnhancePromptResponse:
+    """Enhanced prompt per description, reused for an hour to skip the LLM."""
+    resp = _SESSION.post(
+        f"{FASTAPI_URL}/enhance-prompt",
+        json={"room_description": description},
+        timeout=ENHANCE_TIMEOUT,
+    )
+    result = EnhancePromptResponse.model_validate_json(resp.content)
+    if not result.success:
+        # Raise rather than return so failures are never cached
+        raise RuntimeError(result.error)
+    return result
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _health_check() -> bool:
+    """Backend status, polled at most once every 5 seconds across reruns."""
+    return APIClient.is_online()
+
+
+def _scan_max_input() -> int:
+    """Highest sequence number among existing input files."""
+    nums = (f.stem.rpartition("_")[2] for f in DATA_INPUT_DIR.glob("empty_room_*.*"))
+    return max((int(n) for n in nums if n.isdigit()), default=0)
+
+
+def _next_id() -> int:
+    """Reserves the next input number from the persisted counter file."""
+    fd = os.open(COUNTER_PATH, os.O_CREAT | os.O_RDWR)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        raw = os.read(fd, 32).strip()
+        # Cold start: migrate from the existing files with a one-off scan
+        n = int(raw) if raw.isdigit() else _scan_max_input() + 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(n + 1).encode())
+        return n
+    finally:
+        os.close(fd)
 
 
 def get_next_filename() -> str:
-    """Generates sequential filename for inputs."""
-    existing = list(DATA_INPUT_DIR.glob("empty_room_*.*"))
-    max_num = 0
-    for f in existing:
-        try:
-            max_num = max(max_num, int(f.stem.split("_")[-1]))
-        except ValueError:
-            continue
-    return f"empty_room_{max_num + 1:05d}"
+    """Reserves a sequential filename for inputs."""
+    return f"empty_room_{_next_id():05d}"
 
 
-def save_input_file(file_bytes: bytes, original_name: str) -> Path:
-    """Saves bytes to the input directory with sequential naming."""
+def save_input_file(file_src: Union[bytes, Path], original_name: str) -> Path:
+    """Writes upload bytes or copies a sample file to the input directory with sequential naming."""
     ext = Path(original_name).suffix or ".png"
     filename = f"{get_next_filename()}{ext}"
     path = DATA_INPUT_DIR / filename
-    with open(path, "wb") as f:
-        f.write(file_bytes)
+    if isinstance(file_src, Path):
+        # Kernel-side copy (sendfile on Linux, fcopyfile on macOS)
+        shutil.copyfile(file_src, path)
+    else:
+        path.write_bytes(file_src)
     return path
 
 
-def get_history() -> list[dict]:
-    """Retrieves sorted list of past generations."""
+def _dir_sig(p: Path) -> int:
+    """Directory mtime; changes whenever an entry is added or removed."""
+    return p.stat().st_mtime_ns
+
+
+@st.cache_data(show_spinner=False)
+def _history_cached(sig: int) -> list[dict]:
+    with os.scandir(DATA_OUTPUT_DIR) as it:
+        entries = [
+            (e.stat().st_mtime_ns, e.name)
+            for e in it
+            if e.name.startswith("virtual_staging_") and e.name.endswith(".png")
+        ]
+    entries.sort(reverse=True)
     files = []
-    for f in sorted(DATA_OUTPUT_DIR.glob("virtual_staging_*.png"), reverse=True):
-        files.append({"path": f, "number": f.stem.split("_")[-1]})
+    for mtime_ns, name in entries:
+        f = DATA_OUTPUT_DIR / name
+        files.append(
+            {"path": f, "number": f.stem.rpartition("_")[2], "mtime_ns": mtime_ns}
+        )
     return files
 
 
+def get_history() -> list[dict]:
+    """Retrieves sorted list of past generations."""
+    return _history_cached(_dir_sig(DATA_OUTPUT_DIR))
+
+
 def get_input_for_output(output_path: Path) -> Optional[Path]:
     """Finds the corresponding input file for a generated image."""
-    num = output_path.stem.split("_")[-1]
+    num = output_path.stem.rpartition("_")[2]
     for ext in [".png", ".jpg", ".jpeg"]:
         candidate = DATA_INPUT_DIR / f"empty_room_{num}{ext}"
         if candidate.exists():
@@ -120,15 +239,77 @@ def get_input_for_output(output_path: Path) -> Optional[Path]:
     return None
 
 
+@st.cache_data(max_entries=256, show_spinner=False)
+def _load_meta_cached(path_str: str, mtime: int) -> bytes:
+    return Path(path_str).read_bytes()
+
+
 def load_metadata(output_path: Path) -> dict:
     """Loads metadata JSON if present."""
     meta_path = output_path.with_suffix(".json")
-    if meta_path.exists():
-        try:
-            return json.loads(meta_path.read_text(encoding="utf-8"))
-        except:
-            pass
-    return {}
+    try:
+        mtime = meta_path.stat().st_mtime_ns
+        return _loads(_load_meta_cached(str(meta_path), mtime))
+    except:
+        return {}
+
+
+@st.cache_data(ttl=1, max_entries=128, show_spinner=False)
+def _exists_cached(path: str) -> bool:
+    """Path.exists() memoised for a second; results rarely vanish mid-view."""
+    return Path(path).exists()
+
+
+@st.cache_data(show_spinner=False)
+def _thumb(path: str, mtime: int, max_side: int = 256) -> bytes:
+    """Downscaled WEBP preview, decoded once per (path, mtime)."""
+    with Image.open(path) as im:
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", quality=80)
+    return buf.getvalue()
+
+
+@st.cache_resource
+def _get_executor() -> ThreadPoolExecutor:
+    """Process-wide pool that runs saves and generations off the script thread."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="generation")
+
+
+def _prepare(
+    file_src: Union[bytes, Path], file_name: str, description: str
+) -> tuple[Path, EnhancePromptResponse]:
+    """
+    Saves the input in a worker while the prompt is enhanced; they are independent.
+    The enhancement stays on the script thread, which st.cache_data needs.
+    """
+    saving = _get_executor().submit(save_input_file, file_src, file_name)
+    enh_resp = APIClient.enhance_prompt(description)
+    return saving.result(), enh_resp
+
+
+def _run_generation(
+    input_path: Path, enh_resp: EnhancePromptResponse, description: str, resolution: int
+) -> dict:
+    """Generation request for a saved input; runs in a worker thread."""
+    gen_resp = APIClient.generate_image(
+        enh_resp.sd_prompt,
+        description,
+        str(input_path),
+        resolution,
+        task_type=enh_resp.task_type,
+    )
+    if not gen_resp.success:
+        raise RuntimeError(gen_resp.error)
+    return {
+        "success": True,
+        # Backend returns a served URL; map it to the local file
+        "image_path": str(DATA_OUTPUT_DIR / Path(gen_resp.image_path).name),
+        "input_path": str(input_path),
+        "enhanced_prompt": gen_resp.enhanced_prompt,
+    }
 
 
 # -----------------------------------------------------------------------------
@@ -136,42 +317,52 @@ def load_metadata(output_path: Path) -> dict:
 # -----------------------------------------------------------------------------
 
 
+@st.fragment(run_every=5)
+def _sidebar_fragment():
+    """Sidebar body; refreshes on its own cadence without rerunning the page."""
+    st.markdown("### System Status")
+    try:
+        if _health_check():
+            st.markdown(
+                '<div class="status-indicator status-online">● FastAPI Online</div>',
+                unsafe_allow_html=True,
+            )
+        else:
+            st.markdown(
+                '<div class="status-indicator status-offline">● FastAPI Offline</div>',
+                unsafe_allow_html=True,
+            )
+            st.warning("Ensure backend is running")
+    except Exception as e:
+        st.error(f"Status check failed: {e}")
+
+    st.divider()
+    st.markdown("### ⚡ Quick Start Samples")
+    try:
+        if SAMPLES_DIR.exists():
+            for idx, sample in enumerate(list(SAMPLES_DIR.glob("*.*"))):
+                if sample.suffix.lower() in [".jpg", ".jpeg", ".png"]:
+                    st.image(
+                        _thumb(str(sample), sample.stat().st_mtime_ns),
+                        use_container_width=True,
+                    )
+                    if st.button("Use", key=f"sample_{idx}"):
+                        st.session_state.selected_sample = sample
+                        st.rerun(scope="app")
+    except Exception as e:
+        st.error(f"Sample loading failed: {e}")
+
+
 def render_sidebar():
+    # Fragments cannot open st.sidebar themselves, so enter it from outside
     with st.sidebar:
-        st.markdown("### System Status")
-        try:
-            if APIClient.is_online():
-                st.markdown(
-                    '<div class="status-indicator status-online">● FastAPI Online</div>',
-                    unsafe_allow_html=True,
-                )
-            else:
-                st.markdown(
-                    '<div class="status-indicator status-offline">● FastAPI Offline</div>',
-                    unsafe_allow_html=True,
-                )
-                st.warning("Ensure backend is running")
-        except Exception as e:
-            st.error(f"Status check failed: {e}")
-
-        st.divider()
-        st.markdown("### ⚡ Quick Start Samples")
-        try:
-            if SAMPLES_DIR.exists():
-                for idx, sample in enumerate(list(SAMPLES_DIR.glob("*.*"))):
-                    if sample.suffix.lower() in [".jpg", ".jpeg", ".png"]:
-                        st.image(str(sample), use_container_width=True)
-                        if st.button("Use", key=f"sample_{idx}"):
-                            st.session_state.selected_sample = sample
-                            st.rerun()
-        except Exception as e:
-            st.error(f"Sample loading failed: {e}")
+        _sidebar_fragment()
 
 
 def render_input_section() -> Tuple[
-    Optional[bytes], Optional[str], Optional[str], Optional[int]
+    Optional[Union[bytes, Path]], Optional[str], Optional[str], Optional[int]
 ]:
-    """Renders input column and returns file data + active filename + ready state."""
+    """Renders input column and returns file source + active filename + ready state."""
     st.markdown("### 1. Upload & Describe")
     container = st.container(border=True)
 
@@ -180,21 +371,22 @@ def render_input_section() -> Tuple[
             "Upload empty room image", type=["png", "jpg", "jpeg"]
         )
 
-        file_bytes = None
+        file_src = None
         file_name = None
         is_ready = False
 
         # Priority: Upload > Selected Sample
         if uploaded:
             st.session_state.selected_sample = None
-            file_bytes = uploaded.getvalue()
+            # A snapshot: the live upload is re-read by st.image on every rerun
+            file_src = uploaded.getvalue()
             file_name = uploaded.name
             st.image(uploaded, caption="Uploaded Image", use_container_width=True)
             is_ready = True
-        elif st.session_state.get("selected_sample"):
+        elif st.session_state.selected_sample:
             sample = st.session_state.selected_sample
             try:
-                file_bytes = sample.read_bytes()
+                file_src = sample
                 file_name = sample.name
                 st.image(
                     str(sample),
@@ -225,12 +417,15 @@ def render_input_section() -> Tuple[
                 help="Higher resolution creates sharper images but increases processing time and VRAM usage.",
             )
 
+        busy = st.session_state.job is not None
         generate = st.button(
-            "✨ Generate Staging", type="primary", disabled=not (is_ready and desc)
+            "✨ Generate Staging",
+            type="primary",
+            disabled=busy or not (is_ready and desc),
         )
 
         if generate:
-            return file_bytes, file_name, desc, res
+            return file_src, file_name, desc, res
 
     return None, None, None, None
 
@@ -238,8 +433,8 @@ def render_input_section() -> Tuple[
 def render_result_section():
     st.markdown("### 2. Staged Result")
 
-    if "result" in st.session_state:
-        res = st.session_state.result
+    res = st.session_state.result
+    if res:
         if res.get("success"):
             out_path = Path(res["image_path"])
             in_path = res.get("input_path")
@@ -247,11 +442,11 @@ def render_result_section():
             with st.container(border=True):
                 t1, t2 = st.tabs(["🖼️ Side-by-Side", "📝 Prompt Details"])
                 with t1:
-                    if out_path.exists():
+                    if _exists_cached(str(out_path)):
                         c1, c2 = st.columns(2)
                         with c1:
                             st.caption("Original")
-                            if in_path and Path(in_path).exists():
+                            if in_path and _exists_cached(in_path):
                                 st.image(in_path, use_container_width=True)
                         with c2:
                             st.caption("Staged")
@@ -277,6 +472,25 @@ def render_result_section():
             )
 
 
+@st.fragment(run_every=1)
+def render_job_status():
+    """Polls the background generation and hands its result to the page."""
+    job = st.session_state.job
+    if not job.done():
+        elapsed = time.time() - st.session_state.job_started
+        st.status(f"🏗️ AI is working... ({elapsed:.0f}s)", state="running")
+        return
+
+    st.session_state.job = None
+    try:
+        st.session_state.result = job.result()
+    except Exception as e:
+        # Drop the cached status so the sidebar reflects outages now
+        _health_check.clear()
+        st.session_state.result = {"success": False, "error": str(e)}
+    st.rerun(scope="app")
+
+
 def render_history():
     st.markdown("---")
     st.markdown("### 📂 Recent Designs")
@@ -289,18 +503,22 @@ def render_history():
     for i, item in enumerate(files):
         with cols[i]:
             path = item["path"]
-            if path.exists():
-                st.image(str(path), use_container_width=True)
-                if st.button(f"View #{item['number']}", key=f"hist_{i}"):
-                    # Restore state
-                    meta = load_metadata(path)
-                    st.session_state.result = {
-                        "success": True,
-                        "image_path": str(path),
-                        "input_path": str(get_input_for_output(path) or ""),
-                        "enhanced_prompt": meta.get("prompt", "Restored from history"),
-                    }
-                    st.rerun()
+            try:
+                # The listing's mtime keys the thumbnail; no stat per render
+                thumb = _thumb(str(path), item["mtime_ns"])
+            except FileNotFoundError:
+                continue  # Deleted since the listing was cached
+            st.image(thumb, use_container_width=True)
+            if st.button(f"View #{item['number']}", key=f"hist_{i}"):
+                # Restore state
+                meta = load_metadata(path)
+                st.session_state.result = {
+                    "success": True,
+                    "image_path": str(path),
+                    "input_path": str(get_input_for_output(path) or ""),
+                    "enhanced_prompt": meta.get("prompt", "Restored from history"),
+                }
+                st.rerun()
 
 
 # -----------------------------------------------------------------------------
@@ -308,9 +526,6 @@ def render_history():
 # -----------------------------------------------------------------------------
 def main():
     try:
-        if "selected_sample" not in st.session_state:
-            st.session_state.selected_sample = None
-
         st.markdown(CSS_STYLES, unsafe_allow_html=True)
 
         try:
@@ -328,10 +543,10 @@ def main():
 
         with c_input:
             try:
-                f_bytes, f_name, desc, res = render_input_section()
+                f_src, f_name, desc, res = render_input_section()
             except Exception as e:
                 st.error(f"Input section error: {e}")
-                f_bytes, f_name, desc, res = None, None, None, None
+                f_src, f_name, desc, res = None, None, None, None
 
         with c_result:
             try:
@@ -340,42 +555,22 @@ def main():
                 st.error(f"Result section error: {e}")
 
         # Handle Generation Trigger
-        if f_bytes and desc and f_name and res:
-            with st.status("🏗️ AI is working...", expanded=True) as status:
-                try:
-                    st.write("📤 Saving input...")
-                    input_path = save_input_file(f_bytes, f_name)
-
-                    st.write("🤖 Enhancing prompt...")
-                    enh_resp = APIClient.enhance_prompt(desc)
-                    if not enh_resp.get("success"):
-                        raise Exception(enh_resp.get("error"))
-
-                    st.write(f"🎨 Rendering (Res: {res}px)...")
-                    start = time.time()
-                    gen_resp = APIClient.generate_image(
-                        enh_resp["enhanced_prompt"], desc, str(input_path), res
-                    )
-
-                    if gen_resp.get("success"):
-                        st.session_state.result = {
-                            "success": True,
-                            "image_path": gen_resp["image_path"],
-                            "input_path": str(input_path),
-                            "enhanced_prompt": gen_resp["enhanced_prompt"],
-                        }
-                        status.update(
-                            label=f"✅ Done ({time.time() - start:.1f}s)",
-                            state="complete",
-                            expanded=False,
-                        )
-                        st.rerun()
-                    else:
-                        raise Exception(gen_resp.get("error"))
+        if f_src is not None and desc and f_name and res:
+            try:
+                with st.spinner("📤 Saving input & 🤖 enhancing prompt..."):
+                    input_path, enh_resp = _prepare(f_src, f_name, desc)
+            except Exception as e:
+                # Drop the cached status so the sidebar reflects outages now
+                _health_check.clear()
+                st.session_state.result = {"success": False, "error": str(e)}
+                st.rerun()
+            st.session_state.job = _get_executor().submit(
+                _run_generation, input_path, enh_resp, desc, res
+            )
+            st.session_state.job_started = time.time()
 
-                except Exception as e:
-                    status.update(label="❌ Error", state="error")
-                    st.error(str(e))
+        if st.session_state.job is not None:
+            render_job_status()
 
         render_history()
 
@@ -3,6 +3,8 @@ Configuration Settings
 Centralizes file paths, model constants, and system prompts.
 """
 
+from functools import cache
+from importlib.resources import files
 from pathlib import Path
 
 # -----------------------------------------------------------------------------
@@ -17,6 +19,11 @@ COMFYUI_BASE_PATH = "~/ComfyUI"  # Path to ComfyUI installation
 DATA_INPUT_DIR = PROJECT_ROOT / "data" / "inputs"
 DATA_OUTPUT_DIR = PROJECT_ROOT / "data" / "outputs"
 SAMPLES_DIR = PROJECT_ROOT / "data" / "samples"
+ENHANCEMENT_CACHE_PATH = PROJECT_ROOT / "data" / "enhancement_cache.pkl"
+
+# Generation metadata: one JSON line per image, plus optional per-image sidecars
+GENERATIONS_LOG_PATH = PROJECT_ROOT / "data" / "generations.jsonl"
+WRITE_METADATA_SIDECARS = True  # The Streamlit history view reads the sidecars
 
 # Ensure critical directories exist immediately
 for directory in [DATA_INPUT_DIR, DATA_OUTPUT_DIR]:
@@ -28,6 +35,16 @@ for directory in [DATA_INPUT_DIR, DATA_OUTPUT_DIR]:
 LLM_API_URL = "http://127.0.0.1:8080"  # Default for llama.cpp server
 LLM_MODEL = "default"  # Model identifier (may not be required by llama.cpp)
 
+# How images reach the VLM: "base64" data URLs work with any server; "file"
+# sends file:// URLs, for a server on this machine allowed to read local files
+LLM_IMAGE_TRANSPORT = "base64"
+VLM_IMAGE_DIR = PROJECT_ROOT / "data" / "vlm_images"
+
+# Pooled keep-alive client shared by the LLM and ComfyUI services
+HTTP_TIMEOUT = 120
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE = 16
+
 # -----------------------------------------------------------------------------
 # Model Configurations
 # -----------------------------------------------------------------------------
@@ -37,100 +54,23 @@ CHECKPOINT_NAME = "juggernautxlRagnarok.k3mq.safetensors"
 # -----------------------------------------------------------------------------
 # System Prompts
 # -----------------------------------------------------------------------------
-SYSTEM_PROMPT = """You are a professional Interior Design AI prompt engineer and architectural visualizer. Your task is to generate a precise, concise, and visually achievable chain-of-thought reasoning based on a user-provided instruction and an uploaded image of a room.
-
-Your task is NOT to output the final answer or the edited image. Instead, you must:
-
-Generate a "thinking" or chain-of-thought process that explains how you reason about the interior transformation.
-
-First identify the design task type, then provide reasoning that leads to how the room should be edited.
-
-Always describe materials (e.g., brushed brass, oak wood, velvet), textures, and lighting conditions in detail.
-
-Match the original architectural perspective and camera angle.
-
-Maintain the structural bones of the room (windows, doors, ceiling height) unless the user explicitly asks to change them.
-
-Task Type Handling Rules:
-1. Style & Aesthetic Transformation (e.g., "Make it Minimalist," "Industrial Style"):
-
-Identify the core elements of the requested style (e.g., Scandi uses light woods and neutral tones; Industrial uses raw concrete and metal).
-
-Specify how existing furniture should be modified or replaced to fit this aesthetic.
-
-Describe the new color palette and how it interacts with the room's natural light.
-
-Note what stays unchanged: the floor plan, window placement, and structural boundaries.
-
-2. Object Addition or Replacement (e.g., "Add a marble coffee table," "Change the sofa"):
-
-Specify the exact placement, scale, and material of the new object.
-
-Reason about how the new object receives light and casts shadows based on the room's existing light sources.
-
-Ensure the new furniture matches the scale and perspective of the original room.
-
-Describe the interaction between the new object and existing elements (e.g., a rug under a new table).
-
-3. Surface & Material Editing (e.g., "Change floors to dark wood," "Paint walls sage green"):
-
-Describe the finish (matte, glossy, textured) and the specific hue.
-
-Note how the new surface reflects the environment (e.g., "the dark wood floor should have a slight satin sheen reflecting the window light").
-
-Ensure architectural details like baseboards, moldings, and outlets remain intact and logically integrated.
-
-The length of outputs should be around 80 - 100 words to fully describe the transformation. Always start with "The user wants to ..."
-
-Example Output 1 (Style Transformation):
-The user wants to transform this cluttered living room into a Japandi-style sanctuary. The existing heavy leather sofa should be replaced with a low-profile, cream-colored linen sectional with clean lines. The dark mahogany coffee table is swapped for a light white oak circular table. The walls should change from beige to a soft, matte off-white, while the original large bay window and hardwood floor layout remain identical. Lighting should be softened into a warm, diffused glow, emphasizing natural textures like bamboo and wool, creating a functional yet serene atmosphere.
-
-Example Output 2 (Object Addition/Editing):
-The user wants to add a modern emerald green velvet armchair to the empty corner by the window. The chair should be positioned at a slight inward angle, featuring thin gold-tapered legs that cast realistic shadows on the existing gray carpet. The velvet texture should show subtle highlights where the natural daylight hits the fabric. The rest of the room, including the white bookshelf and the navy blue accent wall, must remain completely unchanged in color and position, ensuring the new armchair feels like a natural extension of the current space."""
-
-# Second step: Convert reasoning to Stable Diffusion optimized prompt
-SD_PROMPT_SYSTEM = """You are a Stable Diffusion XL Prompt Engineer. Your task is to convert an interior design reasoning description into an optimized, comma-separated prompt for image generation.
-
-Rules:
-1. Convert narrative descriptions into comma-separated visual tags
-2. Start with the subject: room type (e.g., "modern living room", "minimalist bedroom")
-3. List key furniture with materials and colors (e.g., "grey linen sofa", "oak wood coffee table")
-4. Describe lighting and atmosphere (e.g., "soft morning sunlight", "warm ambient lighting")
-5. Add material textures (e.g., "velvet texture", "brushed brass finish")
-6. Include quality tags at the end: "masterpiece, 8k resolution, architectural photography, photorealistic, sharp focus, highly detailed"
-7. Keep it under 200 words total
-8. NO narrative text, ONLY comma-separated tags
-9. NO "The user wants" - start directly with visual descriptors
-
-Example Input:
-"The user wants to transform this cluttered living room into a Japandi-style sanctuary. The existing heavy leather sofa should be replaced with a low-profile, cream-colored linen sectional with clean lines."
-
-Example Output:
-Japandi living room interior, low-profile cream linen sectional sofa, clean lines, minimalist furniture, light white oak coffee table, soft matte off-white walls, natural bamboo textures, wool accents, large bay window with natural light, warm diffused lighting, serene atmosphere, functional design, neutral color palette, masterpiece, 8k resolution, architectural photography, photorealistic, sharp focus, highly detailed"""
-
-# Refinement system prompt for iterative design
-REFINEMENT_SYSTEM = """You are a professional Interior Design AI that refines room transformations based on user feedback.
-
-You will receive:
-1. The previous design reasoning
-2. The user's feedback/requests for changes
-3. The previous result image (for visual reference)
-
-Your task is to analyze the feedback and generate an updated design reasoning that addresses the user's concerns while maintaining the overall vision.
-
-Rules:
-1. Acknowledge the user's feedback specifically
-2. Adjust the design to incorporate their requested changes
-3. Keep the length around 80-100 words
-4. Always start with "Based on your feedback, "
-5. Be specific about what changed and what stayed the same
-6. Address each point the user raised
-
-Example:
-Previous reasoning: "The user wants to add a modern emerald green velvet armchair to the empty corner by the window..."
-User feedback: "The chair looks too big. Make it smaller and change the color to navy blue."
-
-Updated reasoning:
-"Based on your feedback, the user wants to add a smaller navy blue velvet armchair to the empty corner by the window. The chair should be positioned at a slight inward angle but with a more compact scale to better fit the space, featuring thin gold-tapered legs. The navy blue velvet texture should show subtle highlights where the natural daylight hits the fabric, creating a more appropriately proportioned piece. The rest of the room, including the white bookshelf and existing decor, must remain completely unchanged, ensuring the new armchair feels like a natural extension of the current space."
-
-Remember: Focus on making specific adjustments based on the feedback while maintaining design coherence."""
+# Prompt texts live in app/prompts/*.txt and are read on first access
+PROMPT_FILES = {
+    "SYSTEM_PROMPT": "system.txt",
+    "SD_PROMPT_SYSTEM": "sd_prompt.txt",
+    "REFINEMENT_SYSTEM": "refinement.txt",
+    "ENHANCE_JSON_SYSTEM": "enhance_json.txt",
+}
+
+
+@cache
+def load_prompt(filename: str) -> str:
+    """Reads a system prompt from the app/prompts directory."""
+    return (files("app") / "prompts" / filename).read_text(encoding="utf-8").strip()
+
+
+def __getattr__(name: str) -> str:
+    # Resolve prompt constants lazily; `from app.config import SYSTEM_PROMPT` still works
+    if name in PROMPT_FILES:
+        return load_prompt(PROMPT_FILES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -82,3 +82,24 @@ class RefineDesignResponse(BaseModel):
     image_path: Optional[str] = None
     success: bool
     error: Optional[str] = None
+
+
+class TaskSubmitResponse(BaseModel):
+    """Response model for a queued image generation."""
+
+    task_id: Optional[str] = None
+    expected_time_seconds: float = Field(
+        0.0, description="Estimated seconds until the result is ready"
+    )
+    success: bool
+    error: Optional[str] = None
+
+
+class TaskStatusResponse(BaseModel):
+    """Progress of a queued image generation."""
+
+    task_id: str
+    status: str = Field(..., description="queued, running, done, failed or unknown")
+    queue_position: int = Field(0, description="Jobs that will run before this one")
+    expected_time_seconds: float = 0.0
+    error: Optional[str] = None
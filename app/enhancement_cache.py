@@ -0,0 +1,102 @@
+"""
+Enhancement Cache
+Reuses prompt enhancements for repeated room descriptions of the same image.
+Descriptions match exactly up to case and whitespace; the image may be re-encoded.
+"""
+
+import pickle
+import time
+from pathlib import Path
+from typing import Optional
+from PIL import Image
+
+CacheKey = tuple[str, Optional[int]]
+
+
+def normalise_text(text: str) -> str:
+    """Case- and whitespace-insensitive form; any other change is a different request."""
+    return " ".join(text.casefold().split())
+
+
+def image_hash(image_path: Optional[str]) -> Optional[int]:
+    """64-bit average hash, stable across re-uploads of the same picture."""
+    if not image_path:
+        return None
+    try:
+        with Image.open(image_path) as img:
+            pixels = list(img.convert("L").resize((8, 8)).getdata())
+    except Exception:
+        return None
+    mean = sum(pixels) / len(pixels)
+    bits = 0
+    for px in pixels:
+        bits = (bits << 1) | (px > mean)
+    return bits
+
+
+class EnhancementCache:
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_hamming: int = 5,
+        ttl: float = 24 * 3600,
+        max_entries: int = 512,
+    ):
+        self.path = path
+        self.max_hamming = max_hamming
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Entries: (normalised text, image hash, stored at, value)
+        self.entries: list[tuple[str, Optional[int], float, dict]] = []
+
+    @staticmethod
+    def key(text: str, image_path: Optional[str] = None) -> CacheKey:
+        """Builds the lookup key; reads the image, so call it off the event loop."""
+        return normalise_text(text), image_hash(image_path)
+
+    def _image_matches(self, a: Optional[int], b: Optional[int]) -> bool:
+        if a is None or b is None:
+            return a is b
+        return bin(a ^ b).count("1") <= self.max_hamming
+
+    def lookup(self, key: CacheKey) -> Optional[dict]:
+        """
+        Returns the newest value stored for the same description and a
+        perceptually identical image (re-uploads and re-encodes still match).
+        """
+        text, img = key
+        cutoff = time.time() - self.ttl
+        for entry_text, entry_img, stored_at, value in reversed(self.entries):
+            if stored_at < cutoff:
+                break  # Entries are in insertion order; the rest are older
+            if entry_text == text and self._image_matches(img, entry_img):
+                return dict(value)
+        return None
+
+    def store(self, key: CacheKey, value: dict):
+        """Adds an entry, dropping expired ones and the oldest beyond capacity."""
+        now = time.time()
+        cutoff = now - self.ttl
+        self.entries = [e for e in self.entries if e[2] >= cutoff]
+        self.entries.append((key[0], key[1], now, dict(value)))
+        del self.entries[: -self.max_entries]
+
+    def load(self):
+        """Restores entries persisted by a previous process, if any."""
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self.entries = pickle.load(f)
+        except Exception as e:
+            print(f"Enhancement cache load failed: {e}")
+
+    def save(self):
+        """Persists entries so the cache survives restarts."""
+        if not self.path:
+            return
+        try:
+            with open(self.path, "wb") as f:
+                pickle.dump(self.entries, f)
+        except Exception as e:
+            print(f"Enhancement cache save failed: {e}")
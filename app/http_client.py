@@ -0,0 +1,20 @@
+"""
+HTTP Client
+Builds the pooled keep-alive client shared by the LLM and ComfyUI services.
+"""
+
+import httpx
+
+from app.config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_TIMEOUT
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Returns an AsyncClient that keeps connections to local servers open."""
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        headers={"Content-Type": "application/json"},
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+    )
@@ -3,11 +3,22 @@ Image-to-Image Controller
 Orchestrates the image generation process via ComfyUI.
 """
 
+import asyncio
+import os
 import shutil
 import time
-import requests
+import uuid
 from pathlib import Path
+from typing import Optional
+import httpx
+import orjson
 
+try:
+    import websockets
+except ImportError:  # Completion is detected by polling instead
+    websockets = None
+
+from app.http_client import create_http_client
 from app.workflow_manager import WorkflowManager
 from app.config import DATA_OUTPUT_DIR, COMFYUI_BASE_PATH
 
@@ -19,17 +30,33 @@ class ComfyUI:
     OUTPUT_DIR = BASE_PATH / "output"
     SERVER_URL = "http://127.0.0.1:8188"
 
-    def __init__(self, server_address: str = None):
+    def __init__(
+        self, server_address: str = None, client: Optional[httpx.AsyncClient] = None
+    ):
         if server_address:
             self.SERVER_URL = f"http://{server_address}"
 
+        # Shared pooled client, normally injected by the FastAPI lifespan
+        self._client = client
+
         self.workflow_manager = WorkflowManager()
 
         # Ensure directories exist
         self.INPUT_DIR.mkdir(parents=True, exist_ok=True)
         self.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    def generate_image(
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled client; built on first use when none was injected."""
+        if self._client is None:
+            self._client = create_http_client()
+        return self._client
+
+    @client.setter
+    def client(self, client: httpx.AsyncClient):
+        self._client = client
+
+    async def generate_image(
         self,
         prompt: str,
         input_image_path: Path,
@@ -64,7 +91,7 @@ class ComfyUI:
             comfy_input_path = self._copy_to_comfy_input(input_image_path)
 
             # 2. Create Workflow with task-specific ControlNet settings
-            workflow = self.workflow_manager.create_custom_workflow(
+            workflow = self.workflow_manager.create_custom_workflow_bytes(
                 prompt=prompt,
                 input_image_path=input_image_path,
                 output_prefix=temp_prefix,
@@ -72,9 +99,17 @@ class ComfyUI:
                 task_type=task_type,
             )
 
-            # 3. Queue & Wait
-            prompt_id = self._queue_prompt(workflow)
-            generated_filename = self._wait_for_generation(prompt_id)
+            # 3. Queue & Wait (subscribe before queueing so no event is missed).
+            # A fresh client ID per call: ComfyUI keeps one socket per ID, so a
+            # shared ID would let overlapping generations steal each other's events
+            client_id = uuid.uuid4().hex
+            ws = await self._open_websocket(client_id)
+            try:
+                prompt_id = await self._queue_prompt(workflow, client_id)
+                generated_filename = await self._wait_for_generation(prompt_id, ws)
+            finally:
+                if ws is not None:
+                    await ws.close()
 
             # 4. Retrieve & Cleanup
             return self._retrieve_result(
@@ -83,36 +118,89 @@ class ComfyUI:
 
         finally:
             # Always clean up the input copy
-            if comfy_input_path and comfy_input_path.exists():
+            if comfy_input_path:
                 try:
                     comfy_input_path.unlink()
                 except OSError:
                     pass
 
     def _copy_to_comfy_input(self, source: Path) -> Path:
-        """Copies the source image to the ComfyUI input folder."""
+        """Links (or, across filesystems, copies) the source image into ComfyUI input."""
         target = self.INPUT_DIR / source.name
-        shutil.copy2(source, target)
+        try:
+            os.link(source, target)
+        except OSError:  # Cross-device, unsupported, or target already exists
+            shutil.copy2(source, target)
         return target
 
-    def _queue_prompt(self, workflow: dict) -> str:
-        """Submits the workflow to the ComfyUI API."""
+    @staticmethod
+    def _move(source: Path, destination: Path):
+        """Renames in place when possible; copies and deletes across filesystems."""
         try:
-            res = requests.post(f"{self.SERVER_URL}/prompt", json={"prompt": workflow})
+            os.replace(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+            try:
+                source.unlink()
+            except OSError:
+                pass
+
+    async def _queue_prompt(self, workflow: bytes, client_id: str) -> str:
+        """Submits the serialized workflow to the ComfyUI API."""
+        # The workflow is already JSON; splice it in rather than re-encoding it
+        body = b'{"prompt":%b,"client_id":%b}' % (workflow, orjson.dumps(client_id))
+        try:
+            res = await self.client.post(f"{self.SERVER_URL}/prompt", content=body)
             if res.status_code != 200:
                 raise RuntimeError(f"ComfyUI Error {res.status_code}: {res.text}")
-            return res.json()["prompt_id"]
-        except requests.exceptions.ConnectionError:
+            return orjson.loads(res.content)["prompt_id"]
+        except httpx.ConnectError:
             raise RuntimeError("Could not connect to ComfyUI. Is the service running?")
 
-    def _wait_for_generation(self, prompt_id: str, timeout: int = 600) -> str:
-        """Polls the history endpoint until the specific prompt ID is finished."""
+    async def _open_websocket(self, client_id: str):
+        """Connects to the ComfyUI event stream, or returns None to poll instead."""
+        if websockets is None:
+            return None
+        url = self.SERVER_URL.replace("http", "ws", 1)
+        try:
+            return await websockets.connect(
+                f"{url}/ws?clientId={client_id}", max_size=None
+            )
+        except Exception:
+            return None
+
+    @staticmethod
+    async def _await_completion(ws, prompt_id: str):
+        """Returns once ComfyUI reports the prompt has finished executing."""
+        async for message in ws:
+            if isinstance(message, bytes):
+                continue  # Binary preview frames
+            event = orjson.loads(message)
+            if event.get("type") == "executing":
+                data = event.get("data", {})
+                if data.get("node") is None and data.get("prompt_id") == prompt_id:
+                    return
+
+    async def _wait_for_generation(
+        self, prompt_id: str, ws=None, timeout: int = 600
+    ) -> str:
+        """Waits for the prompt to finish, then reads its output from history."""
         start_time = time.time()
-        while time.time() - start_time < timeout:
+        if ws is not None:
+            try:
+                await asyncio.wait_for(self._await_completion(ws, prompt_id), timeout)
+            except Exception:
+                # Socket dropped or no event seen; history is the source of truth
+                pass
+
+        # Without a websocket this polls; after a completion event the first
+        # history request already contains the output. History is always
+        # checked at least once, even when the websocket wait used up the timeout
+        while True:
             try:
-                res = requests.get(f"{self.SERVER_URL}/history/{prompt_id}")
+                res = await self.client.get(f"{self.SERVER_URL}/history/{prompt_id}")
                 if res.status_code == 200:
-                    history = res.json()
+                    history = orjson.loads(res.content)
                     if prompt_id in history:
                         # Extract filename from outputs
                         outputs = history[prompt_id].get("outputs", {})
@@ -122,31 +210,23 @@ class ComfyUI:
                                     return img["filename"]
             except Exception:
                 pass  # Transient network errors or partial JSON ignored
-            time.sleep(1)
-
-        raise TimeoutError("Image generation timed out.")
+            if time.time() - start_time >= timeout:
+                raise TimeoutError("Image generation timed out.")
+            await asyncio.sleep(1)
 
     def _retrieve_result(self, filename: str, prefix: str, destination: Path) -> str:
         """Finds the generated file in ComfyUI output, moves it, and cleans up."""
-        source_file = self.OUTPUT_DIR / filename
-
-        # Strategy 1: Direct Filename Match
-        if source_file.exists():
-            shutil.copy2(source_file, destination)
-            try:
-                source_file.unlink()
-            except:
-                pass
+        # Strategy 1: Direct Filename Match (moving doubles as the existence check)
+        try:
+            self._move(self.OUTPUT_DIR / filename, destination)
             return str(destination)
+        except FileNotFoundError:
+            pass
 
         # Strategy 2: Prefix Match (Fallback)
         candidates = list(self.OUTPUT_DIR.glob(f"{prefix}*"))
         if candidates:
-            shutil.copy2(candidates[0], destination)
-            try:
-                candidates[0].unlink()
-            except:
-                pass
+            self._move(candidates[0], destination)
             return str(destination)
 
         raise RuntimeError(f"Generated file missing from {self.OUTPUT_DIR}")
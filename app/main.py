@@ -4,14 +4,15 @@ Exposes endpoints for prompt enhancement and image generation.
 Serves the modern HTML frontend.
 """
 
-import json
-import shutil
-import time
+import asyncio
 import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
+import anyio
+import orjson
 from fastapi import FastAPI, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 
@@ -22,15 +23,53 @@ from app.data_models import (
     GenerateImageResponse,
     RefineDesignRequest,
     RefineDesignResponse,
+    TaskStatusResponse,
+    TaskSubmitResponse,
 )
+from app.http_client import create_http_client
 from app.img2img import ComfyUI
 from app.prompt_enhancer import LLMClient
-from app.config import DATA_INPUT_DIR, DATA_OUTPUT_DIR, PROJECT_ROOT
+from app.task_queue import GenerationQueue
+from app.config import (
+    DATA_INPUT_DIR,
+    DATA_OUTPUT_DIR,
+    GENERATIONS_LOG_PATH,
+    PROJECT_ROOT,
+    WRITE_METADATA_SIDECARS,
+)
 
 # Initialize App & Services
-app = FastAPI(title="Virtual Staging API")
 llm_client = LLMClient()
 comfyui = ComfyUI()
+generation_queue = GenerationQueue()
+# Generation records waiting for the background metadata writer
+metadata_queue: asyncio.Queue = asyncio.Queue()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Shares one pooled async HTTP client between the LLM and ComfyUI services."""
+    async with create_http_client() as client:
+        llm_client.client = client
+        comfyui.client = client
+        generation_queue.start()
+        writer = asyncio.create_task(_metadata_writer())
+        # Load the model in the background so startup is not blocked
+        warmup = asyncio.create_task(llm_client.warmup())
+        yield
+        warmup.cancel()
+        await generation_queue.stop()
+        # Flush records from the last generations before exiting
+        await metadata_queue.join()
+        writer.cancel()
+    llm_client.cache.save()
+
+
+app = FastAPI(
+    title="Virtual Staging API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -52,19 +91,36 @@ app.mount("/static", StaticFiles(directory=frontend_path / "static"), name="stat
 def save_generation_metadata(
     image_path: str, prompt: str, description: str, resolution: int
 ):
-    """Saves a sidecar JSON file with generation details."""
-    try:
-        path = Path(image_path)
-        metadata = {
+    """Queues generation details for the background metadata writer."""
+    metadata_queue.put_nowait(
+        {
+            "image_path": str(image_path),
             "prompt": prompt,
             "description": description,
             "input_image": Path(image_path).name,
             "resolution_setting": resolution,
         }
-        with open(path.with_suffix(".json"), "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
-    except Exception as e:
-        print(f"Metadata save failed: {e}")
+    )
+
+
+async def _metadata_writer():
+    """Appends queued records to generations.jsonl, writing sidecars if enabled."""
+    with open(GENERATIONS_LOG_PATH, "ab") as log:
+        while True:
+            record = await metadata_queue.get()
+            try:
+                image_path = Path(record.pop("image_path"))
+                line = orjson.dumps({"image": image_path.name, **record})
+                log.write(line + b"\n")
+                log.flush()
+                if WRITE_METADATA_SIDECARS:
+                    image_path.with_suffix(".json").write_bytes(
+                        orjson.dumps(record, option=orjson.OPT_INDENT_2)
+                    )
+            except Exception as e:
+                print(f"Metadata save failed: {e}")
+            finally:
+                metadata_queue.task_done()
 
 
 # -----------------------------------------------------------------------------
@@ -88,12 +144,13 @@ async def save_input(file: UploadFile = File(...)):
         # Generate unique filename
         filename_str = file.filename or "image.png"
         ext = Path(filename_str).suffix or ".png"
-        filename = f"input_{uuid.uuid4().hex[:8]}_{int(time.time())}{ext}"
+        filename = f"input_{uuid.uuid4().hex}{ext}"
         file_path = DATA_INPUT_DIR / filename
 
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Stream to disk in chunks without blocking the event loop
+        async with await anyio.open_file(file_path, "wb") as buffer:
+            while chunk := await file.read(1 << 20):
+                await buffer.write(chunk)
 
         return {
             "success": True,
@@ -110,7 +167,7 @@ async def enhance_prompt(request: EnhancePromptRequest):
     """Enhance room description with optional image analysis (multimodal)."""
     try:
         # Pass image path if provided for multimodal analysis
-        enhanced = llm_client.enhance_prompt(
+        enhanced = await llm_client.enhance_prompt(
             request.room_description, image_path=request.image_path
         )
         return EnhancePromptResponse(
@@ -131,22 +188,30 @@ async def enhance_prompt(request: EnhancePromptRequest):
         )
 
 
+async def _generate_and_record(request: GenerateImageRequest) -> str:
+    """Runs one generation and records its metadata; executed by the queue worker."""
+    output_path = await comfyui.generate_image(
+        request.enhanced_prompt,
+        Path(request.image_path),
+        request.target_resolution,
+        task_type=request.task_type,
+    )
+
+    save_generation_metadata(
+        output_path,
+        request.enhanced_prompt,
+        request.room_description,
+        request.target_resolution,
+    )
+    return output_path
+
+
 @app.post("/generate-image", response_model=GenerateImageResponse)
 async def generate_image(request: GenerateImageRequest):
     """Generate staged image from enhanced prompt with task-specific ControlNet settings."""
     try:
-        output_path = comfyui.generate_image(
-            request.enhanced_prompt,
-            Path(request.image_path),
-            request.target_resolution,
-            task_type=request.task_type,
-        )
-
-        save_generation_metadata(
-            output_path,
-            request.enhanced_prompt,
-            request.room_description,
-            request.target_resolution,
+        output_path = await generation_queue.run(
+            lambda: _generate_and_record(request)
         )
 
         return GenerateImageResponse(
@@ -158,6 +223,52 @@ async def generate_image(request: GenerateImageRequest):
         return GenerateImageResponse(success=False, error=str(e))
 
 
+@app.post("/tasks/generate-image", response_model=TaskSubmitResponse)
+async def submit_generate_image(request: GenerateImageRequest):
+    """Queue an image generation and return immediately with its task id."""
+    try:
+        task_id = generation_queue.submit(lambda: _generate_and_record(request))
+        return TaskSubmitResponse(
+            task_id=task_id,
+            expected_time_seconds=generation_queue.expected_time(task_id),
+            success=True,
+        )
+    except Exception as e:
+        return TaskSubmitResponse(success=False, error=str(e))
+
+
+@app.get("/status/{task_id}", response_model=TaskStatusResponse)
+async def task_status(task_id: str):
+    """Report the state of a queued generation."""
+    task = generation_queue.tasks.get(task_id)
+    if task is None:
+        return TaskStatusResponse(task_id=task_id, status="unknown")
+    return TaskStatusResponse(
+        task_id=task_id,
+        status=task["status"],
+        queue_position=generation_queue.position(task_id),
+        expected_time_seconds=generation_queue.expected_time(task_id),
+        error=task["error"],
+    )
+
+
+@app.get("/result/{task_id}", response_model=GenerateImageResponse)
+async def task_result(task_id: str):
+    """Return the output of a finished generation."""
+    task = generation_queue.tasks.get(task_id)
+    if task is None:
+        return GenerateImageResponse(success=False, error=f"Unknown task: {task_id}")
+    if task["status"] == "failed":
+        return GenerateImageResponse(success=False, error=task["error"])
+    if task["status"] != "done":
+        return GenerateImageResponse(
+            success=False, error=f"Task is still {task['status']}"
+        )
+    return GenerateImageResponse(
+        image_path=f"/data/outputs/{Path(task['result']).name}", success=True
+    )
+
+
 @app.post("/refine-design", response_model=RefineDesignResponse)
 async def refine_design(request: RefineDesignRequest):
     """Refine a design based on user feedback and previous result."""
@@ -188,7 +299,7 @@ async def refine_design(request: RefineDesignRequest):
             )
 
         # Step 1: Generate updated reasoning and SD prompt with feedback
-        refined = llm_client.refine_design(
+        refined = await llm_client.refine_design(
             user_feedback=request.user_feedback,
             previous_reasoning=request.previous_reasoning,
             previous_sd_prompt=request.previous_sd_prompt,
@@ -197,11 +308,13 @@ async def refine_design(request: RefineDesignRequest):
 
         # Step 2: Generate new image using original input image
         # This ensures the new generation is still based on the original room
-        output_path = comfyui.generate_image(
-            refined["sd_prompt"],
-            original_image_full_path,
-            request.target_resolution,
-            task_type=refined["task_type"],
+        output_path = await generation_queue.run(
+            lambda: comfyui.generate_image(
+                refined["sd_prompt"],
+                original_image_full_path,
+                request.target_resolution,
+                task_type=refined["task_type"],
+            )
         )
 
         save_generation_metadata(
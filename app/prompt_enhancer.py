@@ -4,64 +4,271 @@ Handles interaction with OpenAI-compatible LLM API with multimodal support (Qwen
 Two-step process: 1) Generate reasoning from image+text, 2) Convert reasoning to SD tags.
 """
 
-import base64
+import asyncio
+import hashlib
+import io
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
-import requests
+from urllib.parse import urlparse
+import httpx
+import orjson
+from PIL import Image
+
+try:
+    import pybase64 as base64  # SIMD-accelerated, same API as the stdlib module
+except ImportError:
+    import base64
+
 from app.config import (
+    ENHANCEMENT_CACHE_PATH,
     LLM_API_URL,
+    LLM_IMAGE_TRANSPORT,
     LLM_MODEL,
     SYSTEM_PROMPT,
     SD_PROMPT_SYSTEM,
     REFINEMENT_SYSTEM,
+    ENHANCE_JSON_SYSTEM,
+    VLM_IMAGE_DIR,
 )
+from app.enhancement_cache import EnhancementCache
+from app.http_client import create_http_client
+
+TASK_TYPES = ("add", "replace", "material", "style")
+
+
+class LLMAPIError(RuntimeError):
+    """Non-200 response from the LLM server."""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"LLM API Error {status_code}: {text}")
+        self.status_code = status_code
+
+
+# Keyword groups for task-type detection, matched at word starts
+TASK_KEYWORDS = re.compile(
+    r"\b(?:"
+    r"(?P<add>add|place|position|insert|put in|include)"
+    r"|(?P<replace>replace|swap|change to|switch|instead of)"
+    r"|(?P<material>paint|floor|wall|surface|material|finish|texture)"
+    r")"
+)
+
+# Structured output for the single-call enhancement
+ENHANCE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "enhancement",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "reasoning": {"type": "string"},
+                "sd_prompt": {"type": "string"},
+                "task_type": {"type": "string", "enum": list(TASK_TYPES)},
+            },
+            "required": ["reasoning", "sd_prompt", "task_type"],
+        },
+    },
+}
+
+# Longest edge sent to the VLM; larger images are downsampled server-side anyway
+VISION_MAX_SIDE = 768
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def _read_fd(fd: int, size: int) -> bytes:
+    """Reads an already-statted file in one call, looping only on short reads."""
+    data = os.read(fd, size)
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _resize_to_jpeg(data: bytes) -> bytes:
+    """Downscales to the VLM input size and encodes as JPEG (q=85)."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _resize_to_data_url(path: str, data: bytes) -> str:
+    """Resized JPEG embedded as a base64 data URL."""
+    encoded = base64.b64encode(_resize_to_jpeg(data)).decode("utf-8")
+    return f"data:image/jpeg;base64,{encoded}"
+
+
+def _resize_to_file_url(path: str, data: bytes) -> str:
+    """Resized JPEG written next to the app data, referenced by file URL."""
+    name = hashlib.blake2b(path.encode("utf-8"), digest_size=8).hexdigest()
+    destination = VLM_IMAGE_DIR / f"{name}.jpg"
+    VLM_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    destination.write_bytes(_resize_to_jpeg(data))
+    return destination.as_uri()
+
+
+def _load_image_url(
+    path: str, known_version: Optional[tuple[int, int]], convert
+) -> tuple[tuple[int, int], Optional[str]]:
+    """
+    Runs in a worker thread, which owns the descriptor from open to close.
+    One open + fstat gives the file version; the file is read and converted
+    only when that differs from known_version (otherwise the URL is None).
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        version = (st.st_mtime_ns, st.st_size)
+        if version == known_version:
+            return version, None
+        data = _read_fd(fd, st.st_size)
+    finally:
+        os.close(fd)
+    return version, convert(path, data)
 
 
 class LLMClient:
+    SD_CACHE_SIZE = 512
+    IMAGE_CACHE_SIZE = 32
+
     def __init__(
         self,
         api_url: str = LLM_API_URL,
         model: str = LLM_MODEL,
         reasoning_prompt: str = SYSTEM_PROMPT,
         sd_prompt: str = SD_PROMPT_SYSTEM,
+        client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[EnhancementCache] = None,
+        image_transport: str = LLM_IMAGE_TRANSPORT,
     ):
         self.api_url = api_url.rstrip("/")
         self.model = model
         self.reasoning_prompt = reasoning_prompt
         self.sd_prompt = sd_prompt
+        # Shared pooled client, normally injected by the FastAPI lifespan
+        self._client = client
+        if cache is None:
+            cache = EnhancementCache(ENHANCEMENT_CACHE_PATH)
+            cache.load()
+        self.cache = cache
+        # File URLs only resolve when the server shares our filesystem
+        self.file_images = (
+            image_transport == "file" and urlparse(self.api_url).hostname in LOCAL_HOSTS
+        )
+        # reasoning digest -> SD tags; repeat/refine rounds skip the second LLM call
+        self._sd_cache: OrderedDict[bytes, str] = OrderedDict()
+        # path -> ((mtime_ns, size), image URL); one entry per file, replaced on change
+        self._image_cache: OrderedDict[str, tuple[tuple[int, int], str]] = (
+            OrderedDict()
+        )
 
-    def _encode_image(self, image_path: str) -> str:
-        """Encode image to base64 string."""
-        path = Path(image_path)
-        if not path.exists():
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled client; built on first use when none was injected."""
+        if self._client is None:
+            self._client = create_http_client()
+        return self._client
+
+    @client.setter
+    def client(self, client: httpx.AsyncClient):
+        self._client = client
+
+    async def _image_url(self, image_path: str) -> str:
+        """URL of a downscaled JPEG copy of the image: base64 data or a local file."""
+        key = str(Path(image_path))
+        entry = self._image_cache.get(key)
+        convert = _resize_to_file_url if self.file_images else _resize_to_data_url
+        try:
+            version, url = await asyncio.to_thread(
+                _load_image_url, key, entry[0] if entry else None, convert
+            )
+        except FileNotFoundError:
             raise FileNotFoundError(f"Image file not found: {image_path}")
-        with open(path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
 
-    def _call_llm(self, system_prompt: str, user_content, max_tokens: int = 512) -> str:
+        if url is None:  # Unchanged since it was cached
+            self._image_cache.move_to_end(key)
+            return entry[1]
+        self._image_cache[key] = (version, url)
+        self._image_cache.move_to_end(key)
+        if len(self._image_cache) > self.IMAGE_CACHE_SIZE:
+            self._image_cache.popitem(last=False)
+        return url
+
+    async def _call_llm(
+        self,
+        system_prompt: str,
+        user_content,
+        max_tokens: int = 512,
+        response_format: Optional[dict] = None,
+    ) -> str:
         """Make API call to LLM."""
-        response = requests.post(
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content},
+            ],
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+            # Static system prompts lead every request, so llama.cpp can
+            # reuse their KV cache instead of re-processing them
+            "cache_prompt": True,
+        }
+        if response_format:
+            payload["response_format"] = response_format
+
+        response = await self.client.post(
             f"{self.api_url}/v1/chat/completions",
-            json={
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                "temperature": 0.7,
-                "max_tokens": max_tokens,
-            },
-            headers={"Content-Type": "application/json"},
-            timeout=120,
+            content=orjson.dumps(payload),
         )
 
         if response.status_code != 200:
-            raise RuntimeError(f"LLM API Error {response.status_code}: {response.text}")
+            raise LLMAPIError(response.status_code, response.text)
 
-        result = response.json()
+        result = orjson.loads(response.content)
         return result["choices"][0]["message"]["content"].strip()
 
-    def generate_reasoning(
+    async def warmup(self):
+        """
+        Sends a one-token request so the model is resident and the system
+        prompt of the enhancement call is already in the server's KV cache.
+        """
+        try:
+            await self._call_llm(
+                f"{self.reasoning_prompt}\n\n{ENHANCE_JSON_SYSTEM}",
+                "ping",
+                max_tokens=1,
+            )
+        except Exception as e:
+            print(f"LLM warmup skipped: {e}")
+
+    async def _build_user_content(
+        self, room_description: str, image_path: Optional[str] = None
+    ):
+        """Message content for the description, with the image attached if present."""
+        if not image_path:
+            return room_description
+        try:
+            # The stat in _image_url is the only existence check
+            image_url = await self._image_url(image_path)
+        except FileNotFoundError:
+            return room_description
+        return [
+            {"type": "text", "text": room_description},
+            {"type": "image_url", "image_url": {"url": image_url}},
+        ]
+
+    async def generate_reasoning(
         self, room_description: str, image_path: Optional[str] = None
     ) -> str:
         """
@@ -75,29 +282,19 @@ class LLMClient:
             str: Reasoning about the transformation (80-100 words).
         """
         try:
-            # Build message content with optional image
-            if image_path and Path(image_path).exists():
-                base64_image = self._encode_image(image_path)
-                user_content = [
-                    {"type": "text", "text": room_description},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                    },
-                ]
-            else:
-                user_content = room_description
-
-            return self._call_llm(self.reasoning_prompt, user_content, max_tokens=512)
-
-        except requests.exceptions.ConnectionError:
+            user_content = await self._build_user_content(room_description, image_path)
+            return await self._call_llm(
+                self.reasoning_prompt, user_content, max_tokens=512
+            )
+
+        except httpx.ConnectError:
             raise Exception(
                 f"Could not connect to LLM API at {self.api_url}. Is the service running?"
             )
         except Exception as e:
             raise Exception(f"LLM reasoning generation failed: {str(e)}")
 
-    def convert_to_sd_prompt(self, reasoning: str) -> str:
+    async def convert_to_sd_prompt(self, reasoning: str) -> str:
         """
         Step 2: Convert reasoning into Stable Diffusion optimized comma-separated tags.
 
@@ -107,22 +304,80 @@ class LLMClient:
         Returns:
             str: Comma-separated tags optimized for SD/CLIP.
         """
+        key = hashlib.blake2b(reasoning.encode("utf-8")).digest()
+        cached = self._sd_cache.get(key)
+        if cached is not None:
+            self._sd_cache.move_to_end(key)
+            return cached
+
         try:
-            user_content = f"Convert this interior design description into Stable Diffusion tags:\n\n{reasoning}"
-            return self._call_llm(self.sd_prompt, user_content, max_tokens=256)
+            # Instructions live in the system prompt; only the dynamic text follows
+            sd_prompt = await self._call_llm(self.sd_prompt, reasoning, max_tokens=256)
 
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             raise Exception(
                 f"Could not connect to LLM API at {self.api_url}. Is the service running?"
             )
         except Exception as e:
             raise Exception(f"SD prompt conversion failed: {str(e)}")
 
-    def enhance_prompt(
+        self._sd_cache[key] = sd_prompt
+        if len(self._sd_cache) > self.SD_CACHE_SIZE:
+            self._sd_cache.popitem(last=False)
+        return sd_prompt
+
+    async def _enhance_structured(
+        self, room_description: str, image_path: Optional[str] = None
+    ) -> dict:
+        """
+        Single-call enhancement returning reasoning, SD tags and task type as JSON.
+
+        Raises:
+            ValueError: If the server rejects response_format (4xx) or the
+                response is not the expected JSON object.
+        """
+        try:
+            user_content = await self._build_user_content(room_description, image_path)
+            content = await self._call_llm(
+                f"{self.reasoning_prompt}\n\n{ENHANCE_JSON_SYSTEM}",
+                user_content,
+                max_tokens=768,
+                response_format=ENHANCE_RESPONSE_FORMAT,
+            )
+        except httpx.ConnectError:
+            raise Exception(
+                f"Could not connect to LLM API at {self.api_url}. Is the service running?"
+            )
+        except LLMAPIError as e:
+            if 400 <= e.status_code < 500:
+                # Servers that reject response_format use the two-step path
+                raise ValueError(str(e))
+            raise Exception(f"LLM enhancement failed: {str(e)}")
+        except Exception as e:
+            raise Exception(f"LLM enhancement failed: {str(e)}")
+
+        data = orjson.loads(content)
+        reasoning = data.get("reasoning") if isinstance(data, dict) else None
+        sd_prompt = data.get("sd_prompt") if isinstance(data, dict) else None
+        if not isinstance(reasoning, str) or not isinstance(sd_prompt, str):
+            raise ValueError("LLM response is missing reasoning or sd_prompt")
+
+        task_type = data.get("task_type")
+        if task_type not in TASK_TYPES:
+            task_type = self._detect_task_type(reasoning, room_description)
+        return {
+            "reasoning": reasoning.strip(),
+            "sd_prompt": sd_prompt.strip(),
+            "task_type": task_type,
+        }
+
+    async def enhance_prompt(
         self, room_description: str, image_path: Optional[str] = None
     ) -> dict:
         """
-        Two-step enhancement: Generate reasoning then convert to SD tags.
+        Enhancement in one structured LLM call, falling back to the two-step
+        reasoning -> SD tags pipeline for servers without JSON output support.
+        Repeated descriptions of the same image are served from the cache.
 
         Args:
             room_description (str): Raw user input.
@@ -131,54 +386,52 @@ class LLMClient:
         Returns:
             dict: Contains both 'reasoning' (for display) and 'sd_prompt' (for generation).
         """
-        # Step 1: Generate reasoning
-        reasoning = self.generate_reasoning(room_description, image_path)
+        key = await asyncio.to_thread(self.cache.key, room_description, image_path)
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            return cached
 
-        # Step 2: Convert to SD tags
-        sd_prompt = self.convert_to_sd_prompt(reasoning)
+        try:
+            result = await self._enhance_structured(room_description, image_path)
+        except ValueError:  # Includes orjson.JSONDecodeError
+            # Step 1: Generate reasoning
+            reasoning = await self.generate_reasoning(room_description, image_path)
 
-        # Step 3: Detect task type for ControlNet adjustment
-        task_type = self._detect_task_type(reasoning, room_description)
+            # Step 2: Convert to SD tags
+            sd_prompt = await self.convert_to_sd_prompt(reasoning)
 
-        return {"reasoning": reasoning, "sd_prompt": sd_prompt, "task_type": task_type}
+            # Step 3: Detect task type for ControlNet adjustment
+            task_type = self._detect_task_type(reasoning, room_description)
 
-    def _detect_task_type(self, reasoning: str, description: str) -> str:
+            result = {
+                "reasoning": reasoning,
+                "sd_prompt": sd_prompt,
+                "task_type": task_type,
+            }
+
+        self.cache.store(key, result)
+        return result
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _detect_task_type(reasoning: str, description: str) -> str:
         """Detect task type from reasoning and description for ControlNet adjustment."""
         text = (reasoning + " " + description).lower()
 
-        # Check for object addition keywords
-        if any(
-            word in text
-            for word in ["add", "place", "position", "insert", "put in", "include"]
-        ):
-            return "add"
-
-        # Check for replacement keywords
-        if any(
-            word in text
-            for word in ["replace", "swap", "change to", "switch", "instead of"]
-        ):
-            return "replace"
-
-        # Check for material/surface changes
-        if any(
-            word in text
-            for word in [
-                "paint",
-                "floor",
-                "wall",
-                "surface",
-                "material",
-                "finish",
-                "texture",
-            ]
-        ):
-            return "material"
+        # Single pass over the text; the priority is add > replace > material
+        found = set()
+        for match in TASK_KEYWORDS.finditer(text):
+            if match.lastgroup == "add":
+                return "add"
+            found.add(match.lastgroup)
+        for task_type in ("replace", "material"):
+            if task_type in found:
+                return task_type
 
         # Default to style transformation
         return "style"
 
-    def refine_design(
+    async def refine_design(
         self,
         user_feedback: str,
         previous_reasoning: str,
@@ -199,26 +452,23 @@ class LLMClient:
         """
         try:
             # Build multimodal content with previous result image
-            base64_image = self._encode_image(previous_result_path)
+            image_url = await self._image_url(previous_result_path)
 
             user_content = [
                 {
                     "type": "text",
-                    "text": f"Previous reasoning: {previous_reasoning}\n\nPrevious SD prompt: {previous_sd_prompt}\n\nUser feedback: {user_feedback}\n\nPlease provide an updated design reasoning that addresses the user's feedback.",
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
+                    "text": f"Previous reasoning: {previous_reasoning}\n\nPrevious SD prompt: {previous_sd_prompt}\n\nUser feedback: {user_feedback}",
                 },
+                {"type": "image_url", "image_url": {"url": image_url}},
             ]
 
             # Step 1: Generate updated reasoning with feedback
-            updated_reasoning = self._call_llm(
+            updated_reasoning = await self._call_llm(
                 REFINEMENT_SYSTEM, user_content, max_tokens=512
             )
 
             # Step 2: Convert updated reasoning to SD tags
-            updated_sd_prompt = self.convert_to_sd_prompt(updated_reasoning)
+            updated_sd_prompt = await self.convert_to_sd_prompt(updated_reasoning)
 
             # Step 3: Detect task type
             task_type = self._detect_task_type(updated_reasoning, user_feedback)
@@ -229,7 +479,7 @@ class LLMClient:
                 "task_type": task_type,
             }
 
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             raise Exception(
                 f"Could not connect to LLM API at {self.api_url}. Is the service running?"
             )
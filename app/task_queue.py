@@ -0,0 +1,120 @@
+"""
+Task Queue
+Runs GPU-bound generation jobs one at a time behind an in-process queue.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+Job = Callable[[], Awaitable[str]]
+
+
+class GenerationQueue:
+    # Initial estimate used until a real generation has been timed
+    DEFAULT_DURATION = 60.0
+
+    def __init__(self, history_size: int = 256):
+        self.history_size = history_size
+        self.tasks: dict[str, dict] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._durations: deque[float] = deque(maxlen=10)
+
+    def start(self):
+        """Creates the queue and its single worker on the running event loop."""
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def submit(self, job: Job) -> str:
+        """Enqueues a job and returns its task id without waiting for it."""
+        task_id = uuid.uuid4().hex
+        self.tasks[task_id] = {
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "done": asyncio.Event(),
+        }
+        self._prune()
+        self.queue.put_nowait((task_id, job))
+        return task_id
+
+    async def wait(self, task_id: str) -> str:
+        """Waits for a task and returns its result, re-raising its failure."""
+        task = self.tasks[task_id]
+        await task["done"].wait()
+        if task["error"] is not None:
+            raise RuntimeError(task["error"])
+        return task["result"]
+
+    async def run(self, job: Job) -> str:
+        """Enqueues a job and waits for its result."""
+        return await self.wait(self.submit(job))
+
+    def position(self, task_id: str) -> int:
+        """Number of jobs that will run before this one (0 once it has started)."""
+        ahead = 0
+        for other_id, task in self.tasks.items():
+            if other_id == task_id:
+                return ahead
+            if task["status"] in ("queued", "running"):
+                ahead += 1
+        return ahead
+
+    def expected_time(self, task_id: str) -> float:
+        """Seconds until the task should finish, from recent generation times."""
+        task = self.tasks[task_id]
+        if task["status"] in ("done", "failed"):
+            return 0.0
+        average = (
+            sum(self._durations) / len(self._durations)
+            if self._durations
+            else self.DEFAULT_DURATION
+        )
+        remaining = average * (self.position(task_id) + 1)
+        if task["status"] == "running":
+            remaining -= time.monotonic() - task["started_at"]
+        return round(max(remaining, 0.0), 1)
+
+    def _prune(self):
+        """Forgets the oldest finished tasks beyond the history size."""
+        excess = len(self.tasks) - self.history_size
+        if excess <= 0:
+            return
+        for task_id in [
+            tid
+            for tid, task in self.tasks.items()
+            if task["status"] in ("done", "failed")
+        ][:excess]:
+            del self.tasks[task_id]
+
+    async def _run(self):
+        while True:
+            task_id, job = await self.queue.get()
+            task = self.tasks.get(task_id)
+            if task is None:
+                self.queue.task_done()
+                continue
+            task["status"] = "running"
+            task["started_at"] = time.monotonic()
+            try:
+                task["result"] = await job()
+                task["status"] = "done"
+                self._durations.append(time.monotonic() - task["started_at"])
+            except Exception as e:
+                task["error"] = str(e)
+                task["status"] = "failed"
+            finally:
+                task["done"].set()
+                self.queue.task_done()
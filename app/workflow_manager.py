@@ -3,18 +3,61 @@ Workflow Manager
 Handles loading and modifying the ComfyUI workflow JSON format.
 """
 
-import json
-import random
-import copy
+import os
+import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
+import orjson
 from PIL import Image
 
 from app.config import CHECKPOINT_NAME
 
+# task_type -> (ControlNet strength, denoise); lower strength = more creative freedom.
+# Adding/replacing objects needs low ControlNet and higher denoise to allow new
+# elements, material changes medium control, and restyling keeps the most.
+_TASK_PARAMS = {
+    "add": (0.08, 0.90),
+    "replace": (0.08, 0.90),
+    "furniture": (0.08, 0.90),
+    "material": (0.10, 0.85),
+    "surface": (0.10, 0.85),
+}
+_DEFAULT_TASK_PARAMS = (0.12, 0.85)  # Style transformations
+
+# Repository root, for resolving the default workflow from other working directories
+_MODULE_ROOT = Path(__file__).resolve().parent.parent
+
+# (resolved path, mtime_ns) -> (parsed workflow, compact JSON); shared by all managers
+_BASE_WORKFLOW_CACHE: dict[tuple[str, int], tuple[dict, bytes]] = {}
+
+
+# Per-request fields: (node ID, input key) -> placeholder in serialized templates
+_SENTINELS = {
+    ("2", "image"): "__TR_IMAGE__",
+    ("22", "text"): "__TR_PROMPT__",
+    ("25", "seed"): "__TR_SEED__",
+    ("213", "factor"): "__TR_SCALE__",
+    ("126", "filename_prefix"): "__TR_PREFIX__",
+}
+_SENTINEL_RE = re.compile(rb'"(__TR_[A-Z]+__)"')
+
+
+def _seed_from(entropy: bytes) -> int:
+    """Maps six random bytes onto the sampler seed range 1..1e12."""
+    return int.from_bytes(entropy, "little") % 1_000_000_000_000 + 1
+
+
+@lru_cache(maxsize=256)
+def _read_image_size(path: str, mtime_ns: int, size: int) -> tuple[int, int]:
+    """Header-only size read; the mtime/size key makes replaced files miss."""
+    with Image.open(path) as img:
+        return img.size
+
 
 class WorkflowManager:
     DEFAULT_WORKFLOW_PATH = Path("workflows/virtual_staging_workflow.json")
+    TEMPLATE_CACHE_SIZE = 32
 
     def __init__(
         self,
@@ -25,13 +68,21 @@ class WorkflowManager:
             Path(workflow_path) if workflow_path else self.DEFAULT_WORKFLOW_PATH
         )
         self.checkpoint_name = checkpoint_name
-        self.base_workflow = self._load_base_workflow()
-
-    def _load_base_workflow(self) -> dict:
-        """Loads the template JSON workflow from disk."""
+        # Compact serialized copy; parsing it is a much cheaper clone than deepcopy
+        self.base_workflow, self._base_json = self._load_base_workflow()
+        # (task_type, target_resolution, checkpoint) -> specialised workflow (read-only)
+        self._template_cache: dict[tuple, dict] = {}
+        # Same key -> that workflow serialized with sentinels in the per-request fields
+        self._template_bytes_cache: dict[tuple, bytes] = {}
+
+    def _load_base_workflow(self) -> tuple[dict, bytes]:
+        """
+        Loads the template JSON workflow from disk, or from the module cache when
+        the file is unchanged. The parsed dict is shared and must not be mutated.
+        """
         # Handle relative path fallback if script is run from different locations
         if not self.workflow_path.exists():
-            fallback = Path(__file__).parent.parent / self.DEFAULT_WORKFLOW_PATH
+            fallback = _MODULE_ROOT / self.DEFAULT_WORKFLOW_PATH
             if fallback.exists():
                 self.workflow_path = fallback
             else:
@@ -39,91 +90,50 @@ class WorkflowManager:
                     f"Workflow file not found: {self.workflow_path}"
                 )
 
-        with open(self.workflow_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        resolved = self.workflow_path.resolve()
+        key = (str(resolved), resolved.stat().st_mtime_ns)
+        cached = _BASE_WORKFLOW_CACHE.get(key)
+        if cached is None:
+            workflow = orjson.loads(resolved.read_bytes())
+            cached = (workflow, orjson.dumps(workflow))
+            _BASE_WORKFLOW_CACHE[key] = cached
+        return cached
 
     def _get_image_dimensions(self, image_path: Path) -> tuple[int, int]:
         """Safely retrieves image dimensions, defaulting to 1024x1024 on error."""
         try:
-            with Image.open(image_path) as img:
-                return img.size
+            st = image_path.stat()
+            return _read_image_size(str(image_path), st.st_mtime_ns, st.st_size)
         except Exception as e:
             print(f"Warning: Could not read image size: {e}")
             return 1024, 1024
 
-    def create_custom_workflow(
-        self,
-        prompt: str,
-        input_image_path: Path,
-        output_prefix: str,
-        target_resolution: int = 1024,
-        task_type: str = "style",
-    ) -> dict:
+    def _get_template(self, task_type: str, target_resolution: int) -> dict:
         """
-        Generates a runtime workflow with specific inputs inserted.
+        Workflow with every edit that depends only on the task type, target
+        resolution and checkpoint already applied. Shared; never mutate it.
+        """
+        key = (task_type, target_resolution, self.checkpoint_name)
+        cached = self._template_cache.get(key)
+        if cached is not None:
+            return cached
 
-        Args:
-            prompt: The SD-optimized prompt
-            input_image_path: Path to input image
-            output_prefix: Prefix for output filename
-            target_resolution: Target resolution
-            task_type: "style" for restyling, "add" for adding objects, "replace" for replacing
+        workflow = orjson.loads(self._base_json)
 
-        Modifications:
-        1. Injects image path, prompt, seed, and checkpoint.
-        2. Adjusts ControlNet strength based on task type (lower for object addition).
-        3. Calculates scaling to ensure SDXL works at ~1024px.
-        4. Optimizes topology: Bypasses the Upscale node if target resolution matches base resolution.
-        """
-        workflow = copy.deepcopy(self.base_workflow)
-
-        # Determine ControlNet strength based on task type
-        # Lower strength = more creativity/freedom for the model
-        if task_type in ["add", "replace", "furniture"]:
-            # Adding/replacing objects needs lower ControlNet to allow new elements
-            controlnet_strength = 0.08
-            denoise = 0.90  # Higher denoise for more creativity
-        elif task_type in ["material", "surface"]:
-            # Material changes need medium control
-            controlnet_strength = 0.10
-            denoise = 0.85
-        else:
-            # Style transformations can keep higher control
-            controlnet_strength = 0.12
-            denoise = 0.85
+        # Determine ControlNet strength and denoise based on task type
+        controlnet_strength, denoise = _TASK_PARAMS.get(task_type, _DEFAULT_TASK_PARAMS)
 
-        # 1. Calculations
-        width, height = self._get_image_dimensions(input_image_path)
-        shortest_side = min(width, height)
-        # Scale to ensure shortest side is 1024 for SDXL generation
-        input_scale_factor = 1024 / shortest_side if shortest_side > 0 else 1.0
         final_scale_factor = target_resolution / 1024.0
-        seed = random.randint(1, 1_000_000_000_000)
-
-        # 2. Node Mapping (Node ID -> Input Key -> Value)
-        # These IDs correspond to specific nodes in the virtual_staging_workflow.json
-        node_updates = {
-            "2": {"image": input_image_path.name},  # Load Image Node
-            "22": {"text": prompt},  # Positive Prompt Node
-            "25": {
-                "seed": seed,
-                "denoise": denoise,
-            },  # KSampler Node with dynamic denoise
-            "7": {"ckpt_name": self.checkpoint_name},  # Checkpoint Loader
-            "213": {"factor": input_scale_factor},  # Initial Downscale Node
-            "126": {"filename_prefix": output_prefix},  # Save Image Node
-            # ControlNet nodes with adjusted strength based on task
-            "10": {"strength": controlnet_strength},  # Lineart ControlNet
-            "17": {"strength": controlnet_strength},  # Depth ControlNet
-            "216": {"strength": controlnet_strength},  # Segmentation ControlNet
-        }
 
-        # Apply updates
-        for node_id, inputs in node_updates.items():
-            if node_id in workflow:
-                workflow[node_id]["inputs"].update(inputs)
+        # Node IDs correspond to specific nodes in the virtual_staging_workflow.json
+        workflow["25"]["inputs"]["denoise"] = denoise  # KSampler Node
+        workflow["7"]["inputs"]["ckpt_name"] = self.checkpoint_name  # Checkpoint Loader
+        # ControlNet nodes with adjusted strength based on task
+        workflow["10"]["inputs"]["strength"] = controlnet_strength  # Lineart
+        workflow["17"]["inputs"]["strength"] = controlnet_strength  # Depth
+        workflow["216"]["inputs"]["strength"] = controlnet_strength  # Segmentation
 
-        # 3. Topology Optimization
+        # Topology Optimization
         # If target is 1024, we don't need the final upscale step.
         is_base_res = abs(target_resolution - 1024) < 1
 
@@ -139,4 +149,106 @@ class WorkflowManager:
                 # Connect Upscale Node output to Save Image input
                 workflow["126"]["inputs"]["images"] = ["131", 0]
 
+        self._template_cache[key] = workflow
+        if len(self._template_cache) > self.TEMPLATE_CACHE_SIZE:
+            del self._template_cache[next(iter(self._template_cache))]
+        return workflow
+
+    def _get_template_bytes(self, task_type: str, target_resolution: int) -> bytes:
+        """Serialized template whose per-request inputs are sentinel strings."""
+        key = (task_type, target_resolution, self.checkpoint_name)
+        cached = self._template_bytes_cache.get(key)
+        if cached is not None:
+            return cached
+
+        workflow = dict(self._get_template(task_type, target_resolution))
+        for (node_id, input_key), sentinel in _SENTINELS.items():
+            self._set_input(workflow, node_id, input_key, sentinel)
+        template = orjson.dumps(workflow)
+
+        self._template_bytes_cache[key] = template
+        if len(self._template_bytes_cache) > self.TEMPLATE_CACHE_SIZE:
+            del self._template_bytes_cache[next(iter(self._template_bytes_cache))]
+        return template
+
+    @staticmethod
+    def _set_input(workflow: dict, node_id: str, key: str, value):
+        """Swaps one node for a copy carrying the new input; the original is kept."""
+        node = workflow[node_id]
+        workflow[node_id] = {**node, "inputs": {**node["inputs"], key: value}}
+
+    def create_custom_workflow(
+        self,
+        prompt: str,
+        input_image_path: Path,
+        output_prefix: str,
+        target_resolution: int = 1024,
+        task_type: str = "style",
+    ) -> dict:
+        """
+        Generates a runtime workflow with specific inputs inserted.
+
+        Args:
+            prompt: The SD-optimized prompt
+            input_image_path: Path to input image
+            output_prefix: Prefix for output filename
+            target_resolution: Target resolution
+            task_type: "style" for restyling, "add" for adding objects, "replace" for replacing
+
+        Modifications:
+        1. Adjusts ControlNet strength based on task type (lower for object addition).
+        2. Optimizes topology: Bypasses the Upscale node if target resolution matches base resolution.
+        3. Injects image path, prompt, seed, and checkpoint.
+        4. Calculates scaling to ensure SDXL works at ~1024px.
+
+        Steps 1-2 and the checkpoint are cached per task type and resolution.
+        Only the patched nodes are copied; the rest are shared with the cached
+        template, so treat the result as read-only (it is serialized as sent).
+        """
+        workflow = dict(self._get_template(task_type, target_resolution))
+        # One urandom read; no shared Mersenne Twister state across threads
+        seed = _seed_from(os.urandom(6))
+
+        set_input = self._set_input
+        set_input(workflow, "2", "image", input_image_path.name)  # Load Image Node
+        set_input(workflow, "22", "text", prompt)  # Positive Prompt Node
+        set_input(workflow, "25", "seed", seed)  # KSampler Node
+        input_scale_factor = self._input_scale_factor(input_image_path)
+        set_input(workflow, "213", "factor", input_scale_factor)  # Initial Downscale
+        set_input(workflow, "126", "filename_prefix", output_prefix)  # Save Image Node
         return workflow
+
+    def create_custom_workflow_bytes(
+        self,
+        prompt: str,
+        input_image_path: Path,
+        output_prefix: str,
+        target_resolution: int = 1024,
+        task_type: str = "style",
+    ) -> bytes:
+        """
+        create_custom_workflow, returned as JSON ready to send to ComfyUI.
+
+        The serialized template is patched in a single regex pass over its
+        sentinels, so no workflow dict is built or re-encoded per request.
+        """
+        input_scale_factor = self._input_scale_factor(input_image_path)
+
+        # orjson.dumps escapes strings, so user text cannot break the JSON
+        values = {
+            b"__TR_IMAGE__": orjson.dumps(input_image_path.name),
+            b"__TR_PROMPT__": orjson.dumps(prompt),
+            b"__TR_SEED__": orjson.dumps(_seed_from(os.urandom(6))),
+            b"__TR_SCALE__": orjson.dumps(input_scale_factor),
+            b"__TR_PREFIX__": orjson.dumps(output_prefix),
+        }
+        return _SENTINEL_RE.sub(
+            lambda m: values[m.group(1)],
+            self._get_template_bytes(task_type, target_resolution),
+        )
+
+    def _input_scale_factor(self, input_image_path: Path) -> float:
+        """Scale that brings the image's shortest side to 1024 for SDXL generation."""
+        width, height = self._get_image_dimensions(input_image_path)
+        shortest_side = min(width, height)
+        return 1024 / shortest_side if shortest_side > 0 else 1.0
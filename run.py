@@ -8,11 +8,17 @@ import sys
 import time
 import os
 import json
-import threading
 import webbrowser
-import urllib.request
+import http.client
 import socket
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:  # Ports are probed with one connect() each instead
+    psutil = None
 
 # Configuration
 PROJECT_ROOT = Path(__file__).parent.resolve()
@@ -67,17 +73,43 @@ ENV_VARS["PYTHONPATH"] = str(PROJECT_ROOT)
 # ----------------------------- Helpers -----------------------------
 
 
-def check_port_in_use(port: int) -> bool:
+def listening_ports() -> Optional[set[int]]:
+    """All TCP ports with a listener, read in one call; None if psutil can't tell."""
+    if psutil is None:
+        return None
+    try:
+        return {
+            conn.laddr.port
+            for conn in psutil.net_connections(kind="inet")
+            if conn.status == psutil.CONN_LISTEN
+        }
+    except (psutil.AccessDenied, OSError):  # e.g. macOS without root
+        return None
+
+
+def check_port_in_use(port: int, listening: Optional[set[int]] = None) -> bool:
     """Check if a port is already in use on localhost."""
-    import socket
+    if listening is not None:
+        return port in listening
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.settimeout(1)  # Don't hang
         return s.connect_ex(("127.0.0.1", port)) == 0
 
 
+# PIDs of services started by this launcher, written together by flush_pids()
+_pending_pids: dict[str, int] = {}
+
+
 def save_pid(service_name: str, pid: int):
-    """Append or update a service PID in the PID file."""
+    """Record a service PID; flush_pids() persists it."""
+    _pending_pids[service_name] = pid
+
+
+def flush_pids():
+    """Merge the recorded PIDs into the PID file with a single read and write."""
+    if not _pending_pids:
+        return
     pids = {}
     if PID_FILE.exists():
         try:
@@ -85,88 +117,68 @@ def save_pid(service_name: str, pid: int):
                 pids = json.load(f)
         except Exception:
             pass
-    pids[service_name] = pid
+    pids.update(_pending_pids)
     with open(PID_FILE, "w") as f:
         json.dump(pids, f)
-
-
-def stream_logs(pipe, prefix: str, log_file):
-    """Stream process output to log file."""
-    if pipe is None:
-        return
-    for line in iter(pipe.readline, b""):
-        if line:
-            text = line.decode("utf-8", errors="replace").rstrip()
-            # Uncomment it for streaming log in terminal
-            # print(f"[{prefix}] {text}")
-            log_file.write(text + "\n")
-            log_file.flush()
+    _pending_pids.clear()
 
 
 # ----------------------------- Service Starters -----------------------------
 
 
-def start_comfyui():
+def start_comfyui(listening: Optional[set[int]] = None):
     """Start ComfyUI server."""
-    if check_port_in_use(COMFYUI_PORT):
+    if check_port_in_use(COMFYUI_PORT, listening):
         print(f"   ⚠️  Port {COMFYUI_PORT} in use. Assuming ComfyUI is running.")
         return None
 
     print("📸 Starting ComfyUI...")
     log_path = LOG_DIR / "comfyui.log"
-    log_file = open(log_path, "w", encoding="utf-8")
 
-    process = subprocess.Popen(
-        [PYTHON_EXEC, "main.py", "--port", str(COMFYUI_PORT)],
-        cwd=COMFYUI_DIR,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        env=ENV_VARS,
-        bufsize=1,
-    )
+    # The child writes straight to the log file; no relay thread in this process
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            [PYTHON_EXEC, "main.py", "--port", str(COMFYUI_PORT)],
+            cwd=COMFYUI_DIR,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            env=ENV_VARS,
+        )
 
     save_pid("comfyui", process.pid)
-    threading.Thread(
-        target=stream_logs, args=(process.stdout, "COMFYUI", log_file), daemon=True
-    ).start()
-    time.sleep(1)
     return process
 
 
-def start_fastapi():
+def start_fastapi(listening: Optional[set[int]] = None):
     """Start FastAPI backend with integrated frontend."""
-    if check_port_in_use(FASTAPI_PORT):
+    if check_port_in_use(FASTAPI_PORT, listening):
         print(f"   ⚠️  Port {FASTAPI_PORT} in use. Assuming FastAPI is running.")
         return None
 
     print("🔌 Starting FastAPI with frontend...")
     log_path = LOG_DIR / "fastapi.log"
-    log_file = open(log_path, "w", encoding="utf-8")
-
-    process = subprocess.Popen(
-        [
-            PYTHON_EXEC,
-            "-m",
-            "uvicorn",
-            "app.main:app",
-            "--reload",
-            "--host",
-            HOST,
-            "--port",
-            str(FASTAPI_PORT),
-        ],
-        cwd=PROJECT_ROOT,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        env=ENV_VARS,
-        bufsize=1,
-    )
+
+    # The child writes straight to the log file; no relay thread in this process
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            [
+                PYTHON_EXEC,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--reload",
+                "--host",
+                HOST,
+                "--port",
+                str(FASTAPI_PORT),
+            ],
+            cwd=PROJECT_ROOT,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            env=ENV_VARS,
+        )
 
     save_pid("fastapi", process.pid)
-    threading.Thread(
-        target=stream_logs, args=(process.stdout, "FASTAPI", log_file), daemon=True
-    ).start()
-    time.sleep(1)
     return process
 
 
@@ -174,12 +186,20 @@ def check_llm_api():
     """Check if LLM API is running (llama.cpp server on port 8080)."""
     print("🤖 Checking LLM API (llama.cpp server on port 8080)...")
 
+    # Any HTTP response means the server is up; poll briefly in case it is starting
+    conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=0.3)
     try:
-        urllib.request.urlopen("http://127.0.0.1:8080/v1/models", timeout=2)
-        print("   ✓ LLM API is running on port 8080")
-        return True
-    except Exception:
-        pass
+        for _ in range(20):
+            try:
+                conn.request("HEAD", "/v1/models")
+                conn.getresponse().read()
+                print("   ✓ LLM API is running on port 8080")
+                return True
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                time.sleep(0.1)
+    finally:
+        conn.close()
 
     print("   ⚠️  LLM API not detected on port 8080")
     print("   Please start your llama.cpp server with: ./server -m <model> --port 8080")
@@ -194,9 +214,22 @@ def main():
     print("🚀 Starting Virtual Staging Services")
     print("========================================\n")
 
-    start_comfyui()
-    start_fastapi()
-    check_llm_api()
+    # One scan answers every "already running?" check
+    listening = listening_ports()
+
+    # Services are independent; launch them and probe the LLM concurrently
+    try:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [
+                pool.submit(start_comfyui, listening),
+                pool.submit(start_fastapi, listening),
+                pool.submit(check_llm_api),
+            ]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        # Record whatever did start, even if another launch failed
+        flush_pids()
 
     # Get local IP for LAN access
     local_ip = get_local_ip()
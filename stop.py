@@ -8,7 +8,14 @@ import sys
 import json
 import os
 import signal
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:  # Ports are found and cleared with netstat/lsof instead
+    psutil = None
 
 # Configuration
 PROJECT_ROOT = Path(__file__).parent.resolve()
@@ -20,8 +27,46 @@ SERVICES = [
     ("Streamlit", 8501),
 ]
 
+def listener_pids(ports: set[int]) -> Optional[set[int]]:
+    """PIDs listening on any of the ports, from one scan; None if psutil can't tell."""
+    if psutil is None:
+        return None
+    try:
+        return {
+            conn.pid
+            for conn in psutil.net_connections(kind="inet")
+            if conn.status == psutil.CONN_LISTEN
+            and conn.laddr.port in ports
+            and conn.pid
+        }
+    except (psutil.AccessDenied, OSError):  # e.g. macOS without root
+        return None
+
+def process_exists(pid: int) -> bool:
+    """Cheap liveness probe: one syscall instead of spawning a kill command."""
+    if sys.platform == "win32":
+        import ctypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Exists, but owned by another user
+        return True
+    return True
+
 def kill_process_by_pid(pid: int) -> bool:
     """Attempt to kill a process by its PID."""
+    # Stale entries (e.g. after a crash) are common; skip them without a kill call
+    if not process_exists(pid):
+        return False
     try:
         if sys.platform == "win32":
             subprocess.run(["taskkill", "/F", "/PID", str(pid)], 
@@ -83,8 +128,15 @@ def main():
     
     # 2. Cleanup via Ports (Fallback)
     print("\n  • Ensuring ports are clear...")
-    for name, port in SERVICES:
-        kill_process_by_port(port)
+    owners = listener_pids({port for _, port in SERVICES})
+    if owners is None:
+        # psutil is missing or denied; ask the system tools port by port
+        for name, port in SERVICES:
+            kill_process_by_port(port)
+    elif owners:
+        # One scan found every listener; kill them all at once
+        with ThreadPoolExecutor(max_workers=len(owners)) as pool:
+            list(pool.map(kill_process_by_pid, owners))
         
     print("\n✅ All app services stopped.")
     print("---------------------------------------------------------")